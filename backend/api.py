@@ -11,11 +11,25 @@ import uvicorn
 from datetime import datetime
 import asyncio
 import os
+import time
 import io
-from predict_churn import run_prediction_pipeline, load_model, feature_engineering, classify_status
+from predict_churn import (
+    run_prediction_pipeline, load_model, load_shadow_models, feature_engineering,
+    prepare_features, classify_status, score_with_shadows, compare_shadow_scores,
+    fetch_customers_from_supabase
+)
+from scheduler import tier_staleness
+from coordination import (
+    get_coordination_store, heartbeat, plan_cycle, claim_next_shard, complete_shard,
+    cycle_finished, renewing_lease, shard_lease_name, latest_cycle_status,
+    current_cycle_id, seconds_until_next_cycle, lease_active, running_shards,
+    MANUAL_RUN_LEASE
+)
 from config import (
     get_cors_origins, MODEL_PATH, API_HOST, API_PORT, API_RELOAD,
-    ENABLE_AUTO_PREDICTIONS, AUTO_PREDICTION_INTERVAL, SUPABASE_URL
+    ENABLE_AUTO_PREDICTIONS, AUTO_PREDICTION_INTERVAL, SUPABASE_URL,
+    REPLICA_ID, REPLICA_HEARTBEAT_TTL, SHARD_LEASE_TTL, SHARD_POLL_INTERVAL,
+    COORDINATION_BACKEND
 )
 import pandas as pd
 
@@ -56,6 +70,8 @@ class PredictionStatus(BaseModel):
     last_run: Optional[str]
     last_result: Optional[Dict]
     last_error: Optional[str]
+    replica_id: Optional[str] = None
+    cluster: Optional[Dict] = None
 
 
 class PredictionResult(BaseModel):
@@ -67,10 +83,15 @@ class PredictionResult(BaseModel):
     predicted_retain: int
     mean_risk_score: float
     timestamp: str
+    shadow_models: Optional[Dict] = None
+    schedule: Optional[Dict] = None
 
 
-def run_prediction_task():
-    """Background task to run the prediction pipeline."""
+def run_prediction_task(shard_index=None, shard_count=None, scheduled=False):
+    """
+    Background task to run the prediction pipeline, optionally on one shard.
+    Scheduled runs only rescore the accounts the adaptive scheduler selects.
+    """
     global prediction_status
     
     try:
@@ -80,7 +101,9 @@ def run_prediction_task():
         print(f"Starting prediction pipeline at {datetime.now()}")
         
         # Run the prediction pipeline
-        results = run_prediction_pipeline()
+        results = run_prediction_pipeline(
+            shard_index=shard_index, shard_count=shard_count, scheduled=scheduled
+        )
         
         # Calculate statistics
         champions = (results['status_classification'] == 'Champion').sum()
@@ -88,7 +111,7 @@ def run_prediction_task():
         critical = (results['status_classification'] == 'Critical').sum()
         predicted_churn = results['prediction'].sum()
         predicted_retain = (~results['prediction']).sum()
-        mean_risk_score = results['churn_risk_score'].mean()
+        mean_risk_score = results['churn_risk_score'].mean() if len(results) else 0.0
         
         prediction_status["last_result"] = {
             "total_customers": len(results),
@@ -98,7 +121,9 @@ def run_prediction_task():
             "predicted_churn": int(predicted_churn),
             "predicted_retain": int(predicted_retain),
             "mean_risk_score": float(mean_risk_score),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            "shadow_models": results.attrs.get('shadow_comparison') or None,
+            "schedule": results.attrs.get('schedule')
         }
         
         prediction_status["last_run"] = datetime.now().isoformat()
@@ -114,6 +139,86 @@ def run_prediction_task():
         prediction_status["is_running"] = False
 
 
+def acquire_manual_run_lease():
+    """
+    Take the cross-replica manual-run lease.
+    Returns a conflict message if another replica is busy, or None once the lease is held.
+    """
+    store = get_coordination_store()
+    if not store.try_acquire(MANUAL_RUN_LEASE, REPLICA_ID, SHARD_LEASE_TTL):
+        return "A prediction job is already running on another replica. Please wait for it to complete."
+    
+    # Scheduled shards check the manual lease after claiming, so one side always backs off
+    if running_shards(store):
+        store.release(MANUAL_RUN_LEASE, REPLICA_ID)
+        return "A scheduled prediction cycle is running. Please wait for it to complete."
+    
+    return None
+
+
+def run_manual_prediction_task(hold_lease=False):
+    """Background task for a manual run; renews the cross-replica lease and releases it when done."""
+    if not hold_lease:
+        run_prediction_task()
+        return
+    
+    try:
+        with renewing_lease(get_coordination_store(), MANUAL_RUN_LEASE):
+            run_prediction_task()
+    finally:
+        try:
+            get_coordination_store().release(MANUAL_RUN_LEASE, REPLICA_ID)
+        except Exception as e:
+            print(f"Failed to release manual run lease: {str(e)}")
+
+
+def run_scheduled_cycle(cycle_id):
+    """
+    Take part in a scheduled prediction cycle.
+    One replica leads and fixes the shard count; every replica then claims
+    and scores unfinished shards until all of them are finished. Shards held
+    by a crashed replica are picked up once their lease expires.
+    """
+    store = get_coordination_store()
+    
+    plan = plan_cycle(store, cycle_id)
+    if plan is None:
+        print(f"No plan found for cycle {cycle_id}, skipping")
+        return
+    
+    while True:
+        shard_index = claim_next_shard(store, plan)
+        if shard_index is None:
+            if cycle_finished(store, plan):
+                break
+            
+            # Other replicas still hold shards; wait in case one of them crashes
+            time.sleep(SHARD_POLL_INTERVAL)
+            continue
+        
+        # A manual full run rewrites every account; give the shard back and wait
+        if lease_active(store, MANUAL_RUN_LEASE):
+            store.release(shard_lease_name(cycle_id, shard_index), REPLICA_ID)
+            print(f"Manual prediction running, shard {shard_index} of cycle {cycle_id} waits")
+            time.sleep(SHARD_POLL_INTERVAL)
+            continue
+        
+        print(f"Replica {REPLICA_ID} scoring shard {shard_index + 1}/{plan['shard_count']} of cycle {cycle_id}")
+        with renewing_lease(store, shard_lease_name(cycle_id, shard_index)):
+            run_prediction_task(
+                shard_index=shard_index, shard_count=plan['shard_count'], scheduled=True
+            )
+        
+        error = prediction_status["last_error"]
+        recorded = complete_shard(
+            store, cycle_id, shard_index,
+            result=None if error else prediction_status["last_result"],
+            error=error
+        )
+        if not recorded:
+            print(f"Shard {shard_index} of cycle {cycle_id} was taken over by another replica; outcome not recorded")
+
+
 @app.get("/")
 async def root():
     """API health check endpoint."""
@@ -138,8 +243,20 @@ async def trigger_prediction(background_tasks: BackgroundTasks):
             detail="A prediction job is already running. Please wait for it to complete."
         )
     
+    # Coordinate with other replicas only when they run scheduled cycles
+    hold_lease = False
+    if ENABLE_AUTO_PREDICTIONS:
+        try:
+            conflict = await asyncio.to_thread(acquire_manual_run_lease)
+        except Exception as e:
+            print(f"Coordination store unavailable, using local check only: {str(e)}")
+        else:
+            if conflict:
+                raise HTTPException(status_code=409, detail=conflict)
+            hold_lease = True
+    
     # Add the prediction task to background tasks
-    background_tasks.add_task(run_prediction_task)
+    background_tasks.add_task(run_manual_prediction_task, hold_lease)
     
     return PredictionResponse(
         message="Prediction job started successfully",
@@ -152,13 +269,25 @@ async def trigger_prediction(background_tasks: BackgroundTasks):
 async def get_prediction_status():
     """
     Get the current status of prediction jobs.
-    Returns information about running jobs and last completed job.
+    Returns information about running jobs and last completed job,
+    plus the last scheduled cycle aggregated across replicas.
     """
+    cluster = None
+    if ENABLE_AUTO_PREDICTIONS:
+        try:
+            cluster = await asyncio.to_thread(
+                latest_cycle_status, get_coordination_store(), AUTO_PREDICTION_INTERVAL
+            )
+        except Exception as e:
+            print(f"Failed to read cycle status: {str(e)}")
+    
     return PredictionStatus(
         is_running=prediction_status["is_running"],
         last_run=prediction_status["last_run"],
         last_result=prediction_status["last_result"],
-        last_error=prediction_status["last_error"]
+        last_error=prediction_status["last_error"],
+        replica_id=REPLICA_ID,
+        cluster=cluster
     )
 
 
@@ -176,11 +305,37 @@ async def get_last_results():
     return PredictionResult(**prediction_status["last_result"])
 
 
+@app.get("/predict/staleness")
+async def get_score_staleness():
+    """
+    Get per-tier score staleness for the adaptive scheduler.
+    Reports accounts, due accounts and score age for each refresh tier.
+    """
+    try:
+        # Fetching the whole table and tiering it is blocking work
+        df = await asyncio.to_thread(fetch_customers_from_supabase)
+        tiers = await asyncio.to_thread(tier_staleness, df)
+        
+        return {
+            "tiers": tiers,
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        print(f"Error computing staleness: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error computing staleness: {str(e)}"
+        )
+
+
 @app.post("/predict/batch")
 async def batch_score_customers(file: UploadFile = File(...)):
     """
     Score multiple customers from uploaded CSV file.
     Returns churn risk scores and classifications for each customer.
+    Configured shadow models are scored on the same features and only
+    their agreement stats are returned.
     """
     try:
         # Validate file type
@@ -206,18 +361,25 @@ async def batch_score_customers(file: UploadFile = File(...)):
                 detail=f"Missing required columns: {', '.join(missing_columns)}"
             )
         
-        # Load model
+        # Load champion and shadow models
         model = load_model()
+        shadow_models = load_shadow_models()
         
         # Engineer features
         df_features = feature_engineering(df)
         
         # Make predictions
-        X = df_features.drop(['customer_id'], axis=1, errors='ignore')
+        X, _ = prepare_features(df_features)
         
-        # Get risk scores and predictions
-        risk_scores = model.predict_proba(X)[:, 1]
-        predictions = model.predict(X)
+        # Get risk scores and predictions for every model on the same matrix
+        champion_scores, shadow_scores = score_with_shadows(model, shadow_models, X)
+        predictions, risk_scores = champion_scores
+        
+        shadow_comparison = None
+        if shadow_scores:
+            shadow_comparison = compare_shadow_scores(
+                df['customer_id'], champion_scores, shadow_scores, source='batch'
+            )
         
         # Classify status
         status_classifications = [classify_status(score) for score in risk_scores]
@@ -236,7 +398,8 @@ async def batch_score_customers(file: UploadFile = File(...)):
         return {
             "message": "Batch scoring completed successfully",
             "total_customers": len(results),
-            "results": results
+            "results": results,
+            "shadow_models": shadow_comparison
         }
         
     except pd.errors.ParserError as e:
@@ -270,15 +433,38 @@ async def health_check():
 # Background scheduler for automatic predictions
 async def scheduled_predictions():
     """
-    Run predictions on a schedule (every 6 hours).
+    Run adaptive scheduled predictions (every AUTO_PREDICTION_INTERVAL seconds).
+    Each cycle rescores only the accounts due for their risk tier.
+    Cycles are aligned to the wall clock so all replicas join the same cycle.
     """
     while True:
-        # Wait for configured interval
-        await asyncio.sleep(AUTO_PREDICTION_INTERVAL)
+        # Wait for the next cycle boundary
+        await asyncio.sleep(seconds_until_next_cycle(AUTO_PREDICTION_INTERVAL))
         
         if not prediction_status["is_running"]:
             print(f"Running scheduled prediction at {datetime.now()}")
-            run_prediction_task()
+            try:
+                await asyncio.to_thread(
+                    run_scheduled_cycle, current_cycle_id(AUTO_PREDICTION_INTERVAL)
+                )
+            except Exception as e:
+                print(f"Scheduled cycle failed: {str(e)}")
+
+
+async def replica_heartbeat():
+    """
+    Keep this replica registered as live so it is counted when shards are planned.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(heartbeat, get_coordination_store(), {
+                "is_running": prediction_status["is_running"],
+                "last_run": prediction_status["last_run"]
+            })
+        except Exception as e:
+            print(f"Replica heartbeat failed: {str(e)}")
+        
+        await asyncio.sleep(REPLICA_HEARTBEAT_TTL / 3)
 
 
 @app.on_event("startup")
@@ -292,10 +478,12 @@ async def startup_event():
     print(f"Model file exists: {os.path.exists(MODEL_PATH)}")
     print(f"Supabase URL: {SUPABASE_URL or 'Not set'}")
     print(f"CORS origins: {get_cors_origins()}")
+    print(f"Replica id: {REPLICA_ID} (coordination: {COORDINATION_BACKEND})")
     
     # Enable automatic scheduled predictions if environment variable is set
     if ENABLE_AUTO_PREDICTIONS:
-        print(f"Auto predictions enabled (every {AUTO_PREDICTION_INTERVAL} seconds)")
+        print(f"Auto predictions enabled (adaptive, cycle every {AUTO_PREDICTION_INTERVAL} seconds)")
+        asyncio.create_task(replica_heartbeat())
         asyncio.create_task(scheduled_predictions())
     else:
         print("Auto predictions disabled (use ENABLE_AUTO_PREDICTIONS=true to enable)")
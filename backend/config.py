@@ -4,6 +4,7 @@ Contains constants, thresholds, and environment variable management.
 """
 
 import os
+import socket
 from typing import List
 from dotenv import load_dotenv
 
@@ -27,6 +28,16 @@ SUPABASE_KEY = os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY')
 # Model Configuration
 MODEL_PATH = os.getenv('MODEL_PATH', 'xgb_model.pkl')
 
+# Shadow (challenger) models scored alongside the champion, comma-separated.
+# Their scores are logged for comparison but never written to the database.
+SHADOW_MODEL_PATHS: List[str] = [
+    path.strip()
+    for path in os.getenv('SHADOW_MODEL_PATHS', '').split(',')
+    if path.strip()
+]
+SHADOW_LOG_PATH = os.getenv('SHADOW_LOG_PATH', 'shadow_scores.csv')
+SHADOW_MAX_WORKERS = int(os.getenv('SHADOW_MAX_WORKERS', '4'))
+
 # Classification Thresholds
 CHAMPION_THRESHOLD = 0.50  # Risk score < 50% = Champion
 AT_RISK_THRESHOLD = 0.75   # Risk score 50-75% = At-Risk
@@ -87,7 +98,33 @@ def get_cors_origins() -> List[str]:
 
 # Auto prediction schedule
 ENABLE_AUTO_PREDICTIONS = os.getenv('ENABLE_AUTO_PREDICTIONS', 'false').lower() == 'true'
-AUTO_PREDICTION_INTERVAL = 21600  # 6 hours in seconds
+# Scheduler cycle length; each cycle rescores only the accounts that are due
+AUTO_PREDICTION_INTERVAL = int(os.getenv('AUTO_PREDICTION_INTERVAL', '900'))  # 15 minutes
+
+# Adaptive scheduling: target seconds between rescores per risk tier
+TIER_REFRESH_INTERVALS = {
+    'Unscored': 0,  # Always due
+    'Critical': int(os.getenv('REFRESH_INTERVAL_CRITICAL', '3600')),    # 1 hour
+    'Boundary': int(os.getenv('REFRESH_INTERVAL_BOUNDARY', '7200')),    # 2 hours
+    'At-Risk': int(os.getenv('REFRESH_INTERVAL_AT_RISK', '10800')),     # 3 hours
+    'Champion': int(os.getenv('REFRESH_INTERVAL_CHAMPION', '86400')),   # 24 hours
+}
+BOUNDARY_MARGIN = float(os.getenv('BOUNDARY_MARGIN', '0.05'))  # Distance from a threshold
+SCHEDULER_CYCLE_BUDGET = int(os.getenv('SCHEDULER_CYCLE_BUDGET', '500'))  # Max accounts per cycle
+SCHEDULER_HEADROOM = 1.25  # Pace above steady state so backlogs drain
+SCHEDULER_MIN_REFRESH_RATIO = 0.5  # Never rescore before half the tier interval
+
+# Multi-replica coordination
+# 'sqlite' coordinates replicas sharing a host/volume, 'supabase' coordinates across hosts
+COORDINATION_BACKEND = os.getenv('COORDINATION_BACKEND', 'sqlite').lower()
+COORDINATION_DB_PATH = os.getenv('COORDINATION_DB_PATH', 'coordination.db')
+COORDINATION_TABLE = os.getenv('COORDINATION_TABLE', 'prediction_leases')
+COORDINATION_RETENTION = 86400  # Keep finished cycle records for 1 day
+REPLICA_ID = os.getenv('REPLICA_ID') or f"{socket.gethostname()}-{os.getpid()}"
+REPLICA_HEARTBEAT_TTL = int(os.getenv('REPLICA_HEARTBEAT_TTL', '60'))
+SHARD_LEASE_TTL = int(os.getenv('SHARD_LEASE_TTL', '120'))  # Renewed while running; reclaimed after a crash
+SHARD_POLL_INTERVAL = int(os.getenv('SHARD_POLL_INTERVAL', '30'))  # Wait between checks for unfinished shards
+ENABLE_SHARDED_PREDICTIONS = os.getenv('ENABLE_SHARDED_PREDICTIONS', 'false').lower() == 'true'
 
 # Validation
 def validate_config():
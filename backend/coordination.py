@@ -0,0 +1,400 @@
+"""
+Multi-replica coordination for scheduled predictions.
+Provides lease stores (SQLite or Supabase), replica heartbeats, cycle
+leadership and shard claiming so that API replicas share the scoring work.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+from postgrest.exceptions import APIError
+from config import (
+    COORDINATION_BACKEND, COORDINATION_DB_PATH, COORDINATION_TABLE,
+    COORDINATION_RETENTION, REPLICA_ID, REPLICA_HEARTBEAT_TTL,
+    SHARD_LEASE_TTL, ENABLE_SHARDED_PREDICTIONS
+)
+
+REPLICA_PREFIX = 'replica:'
+UNIQUE_VIOLATION = '23505'  # Postgres error code for a duplicate key
+FINISHED_STATES = ('completed', 'failed')
+
+# Lease held by a manual full run; scheduled shards never run alongside it
+MANUAL_RUN_LEASE = 'manual-run'
+
+
+class SQLiteLeaseStore:
+    """Lease store backed by a local SQLite file shared by replicas on one host."""
+
+    def __init__(self, db_path: str = COORDINATION_DB_PATH):
+        self.db_path = db_path
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "name TEXT PRIMARY KEY, "
+                "holder_id TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, "
+                "payload TEXT)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode so transactions are controlled explicitly
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _to_record(row) -> Dict:
+        return {
+            "name": row[0],
+            "holder_id": row[1],
+            "expires_at": row[2],
+            "payload": json.loads(row[3]) if row[3] else {}
+        }
+
+    def try_acquire(self, name: str, holder_id: str, ttl: float,
+                    payload: Optional[Dict] = None) -> bool:
+        """Take or renew a lease unless another holder has an unexpired claim."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT holder_id, expires_at, payload FROM leases WHERE name = ?',
+                    (name,)
+                ).fetchone()
+                if row is not None and row[0] != holder_id and row[1] > now:
+                    conn.execute('ROLLBACK')
+                    return False
+
+                stored_payload = json.dumps(payload) if payload is not None else (row[2] if row else None)
+                conn.execute(
+                    'INSERT OR REPLACE INTO leases (name, holder_id, expires_at, payload) '
+                    'VALUES (?, ?, ?, ?)',
+                    (name, holder_id, now + ttl, stored_payload)
+                )
+                conn.execute('COMMIT')
+                return True
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def release(self, name: str, holder_id: str):
+        """Drop a lease if it is still held by holder_id."""
+        with closing(self._connect()) as conn:
+            conn.execute('DELETE FROM leases WHERE name = ? AND holder_id = ?', (name, holder_id))
+
+    def get(self, name: str) -> Optional[Dict]:
+        """Return a lease record, expired or not."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                'SELECT name, holder_id, expires_at, payload FROM leases WHERE name = ?',
+                (name,)
+            ).fetchone()
+        return self._to_record(row) if row else None
+
+    def list(self, prefix: str) -> List[Dict]:
+        """Return all lease records whose name starts with prefix."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT name, holder_id, expires_at, payload FROM leases WHERE substr(name, 1, ?) = ?',
+                (len(prefix), prefix)
+            ).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def purge_expired(self, before: float):
+        """Delete leases that expired before the given timestamp."""
+        with closing(self._connect()) as conn:
+            conn.execute('DELETE FROM leases WHERE expires_at < ?', (before,))
+
+
+class SupabaseLeaseStore:
+    """Lease store backed by a Supabase table shared by replicas on any host."""
+
+    def __init__(self, client, table: str = COORDINATION_TABLE):
+        self.client = client
+        self.table = table
+
+    def try_acquire(self, name: str, holder_id: str, ttl: float,
+                    payload: Optional[Dict] = None) -> bool:
+        """Take or renew a lease unless another holder has an unexpired claim."""
+        now = time.time()
+        row = {'name': name, 'holder_id': holder_id, 'expires_at': now + ttl}
+        if payload is not None:
+            row['payload'] = payload
+
+        # Renew or take over the lease if it is ours or has expired (the common case)
+        response = self.client.table(self.table).update(row) \
+            .eq('name', name) \
+            .or_(f'holder_id.eq.{holder_id},expires_at.lt.{now}') \
+            .execute()
+        if response.data:
+            return True
+
+        # No row matched: either nobody has held the lease yet or someone else holds it
+        try:
+            self.client.table(self.table).insert(row).execute()
+            return True
+        except APIError as e:
+            # A duplicate key means another replica holds it or won the insert race
+            if e.code == UNIQUE_VIOLATION:
+                return False
+            raise
+
+    def release(self, name: str, holder_id: str):
+        """Drop a lease if it is still held by holder_id."""
+        self.client.table(self.table).delete().eq('name', name).eq('holder_id', holder_id).execute()
+
+    def get(self, name: str) -> Optional[Dict]:
+        """Return a lease record, expired or not."""
+        response = self.client.table(self.table).select('*').eq('name', name).execute()
+        if not response.data:
+            return None
+        record = response.data[0]
+        record['payload'] = record.get('payload') or {}
+        return record
+
+    def list(self, prefix: str) -> List[Dict]:
+        """Return all lease records whose name starts with prefix."""
+        response = self.client.table(self.table).select('*').like('name', f'{prefix}%').execute()
+        records = [record for record in response.data if record['name'].startswith(prefix)]
+        for record in records:
+            record['payload'] = record.get('payload') or {}
+        return records
+
+    def purge_expired(self, before: float):
+        """Delete leases that expired before the given timestamp."""
+        self.client.table(self.table).delete().lt('expires_at', before).execute()
+
+
+_store = None
+
+
+def get_coordination_store():
+    """Return the configured lease store, creating it on first use."""
+    global _store
+
+    if _store is None:
+        if COORDINATION_BACKEND == 'supabase':
+            from predict_churn import supabase
+            _store = SupabaseLeaseStore(supabase)
+        elif COORDINATION_BACKEND == 'sqlite':
+            _store = SQLiteLeaseStore()
+        else:
+            raise ValueError(f"Unknown COORDINATION_BACKEND: {COORDINATION_BACKEND}")
+
+    return _store
+
+
+def cycle_lease_name(cycle_id: int) -> str:
+    return f'cycle:{cycle_id}'
+
+
+def shard_lease_name(cycle_id: int, shard_index: int) -> str:
+    return f'cycle:{cycle_id}:shard:{shard_index}'
+
+
+def current_cycle_id(interval: float, now: Optional[float] = None) -> int:
+    """Cycles are aligned to wall-clock multiples of the interval on every replica."""
+    if now is None:
+        now = time.time()
+    return int(now // interval)
+
+
+def seconds_until_next_cycle(interval: float, now: Optional[float] = None) -> float:
+    if now is None:
+        now = time.time()
+    return interval - (now % interval)
+
+
+def heartbeat(store, status: Optional[Dict] = None):
+    """Advertise this replica as live for REPLICA_HEARTBEAT_TTL seconds."""
+    store.try_acquire(REPLICA_PREFIX + REPLICA_ID, REPLICA_ID, REPLICA_HEARTBEAT_TTL, status or {})
+
+
+def live_replicas(store) -> List[str]:
+    """Return the sorted ids of replicas with an unexpired heartbeat."""
+    now = time.time()
+    return sorted(
+        record['holder_id'] for record in store.list(REPLICA_PREFIX)
+        if record['expires_at'] > now
+    )
+
+
+def plan_cycle(store, cycle_id: int) -> Optional[Dict]:
+    """
+    Elect the leader for a cycle and return its plan.
+    The first replica to take the cycle lease becomes leader and fixes the
+    shard count; every other replica reads the plan it wrote.
+    """
+    replicas = live_replicas(store)
+    if REPLICA_ID not in replicas:
+        replicas = sorted(replicas + [REPLICA_ID])
+
+    plan = {
+        "cycle_id": cycle_id,
+        "leader": REPLICA_ID,
+        "shard_count": len(replicas) if ENABLE_SHARDED_PREDICTIONS else 1,
+        "replicas": replicas,
+        "planned_at": datetime.now().isoformat()
+    }
+
+    if store.try_acquire(cycle_lease_name(cycle_id), REPLICA_ID, COORDINATION_RETENTION, plan):
+        print(f"Replica {REPLICA_ID} leads cycle {cycle_id} with {plan['shard_count']} shard(s)")
+        store.purge_expired(time.time())
+        return plan
+
+    lease = store.get(cycle_lease_name(cycle_id))
+    return lease['payload'] if lease else None
+
+
+def claim_next_shard(store, plan: Dict) -> Optional[int]:
+    """Claim an unfinished shard of the cycle, starting from this replica's own slot."""
+    cycle_id = plan['cycle_id']
+    shard_count = plan['shard_count']
+    replicas = plan.get('replicas', [])
+    start = replicas.index(REPLICA_ID) if REPLICA_ID in replicas else 0
+
+    for offset in range(shard_count):
+        shard_index = (start + offset) % shard_count
+        name = shard_lease_name(cycle_id, shard_index)
+
+        lease = store.get(name)
+        if lease and lease['payload'].get('state') in FINISHED_STATES:
+            continue
+
+        claimed = store.try_acquire(name, REPLICA_ID, SHARD_LEASE_TTL, {
+            "state": "running",
+            "replica_id": REPLICA_ID,
+            "started_at": datetime.now().isoformat()
+        })
+        if claimed:
+            return shard_index
+
+    return None
+
+
+def lease_active(store, name: str) -> bool:
+    """Return True if any replica holds an unexpired lease with this name."""
+    lease = store.get(name)
+    return lease is not None and lease['expires_at'] > time.time()
+
+
+def running_shards(store) -> List[str]:
+    """Return the names of shards any replica is currently scoring."""
+    now = time.time()
+    return [
+        record['name'] for record in store.list('cycle:')
+        if ':shard:' in record['name']
+        and record['expires_at'] > now
+        and record['payload'].get('state') == 'running'
+    ]
+
+
+def cycle_finished(store, plan: Dict) -> bool:
+    """Return True once every shard of the cycle has completed or failed."""
+    finished = {
+        record['name'] for record in store.list(f"cycle:{plan['cycle_id']}:shard:")
+        if record['payload'].get('state') in FINISHED_STATES
+    }
+    return all(
+        shard_lease_name(plan['cycle_id'], shard_index) in finished
+        for shard_index in range(plan['shard_count'])
+    )
+
+
+@contextmanager
+def renewing_lease(store, name: str, ttl: float = SHARD_LEASE_TTL):
+    """Renew a held lease in the background until the block exits."""
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(ttl / 3):
+            try:
+                if not store.try_acquire(name, REPLICA_ID, ttl):
+                    print(f"Lost lease {name} to another replica")
+                    return
+            except Exception as e:
+                print(f"Failed to renew lease {name}: {str(e)}")
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def complete_shard(store, cycle_id: int, shard_index: int,
+                   result: Optional[Dict] = None, error: Optional[str] = None) -> bool:
+    """
+    Record the outcome of a shard and keep it claimed for the rest of the cycle.
+    Returns False if another replica has taken the shard over.
+    """
+    return store.try_acquire(shard_lease_name(cycle_id, shard_index), REPLICA_ID, COORDINATION_RETENTION, {
+        "state": "failed" if error else "completed",
+        "replica_id": REPLICA_ID,
+        "finished_at": datetime.now().isoformat(),
+        "result": result,
+        "error": error
+    })
+
+
+def aggregate_results(results: List[Dict]) -> Optional[Dict]:
+    """Combine per-shard prediction summaries into one portfolio summary."""
+    if not results:
+        return None
+
+    count_keys = ['total_customers', 'champions', 'at_risk', 'critical',
+                  'predicted_churn', 'predicted_retain']
+    aggregated = {key: sum(result.get(key, 0) for result in results) for key in count_keys}
+
+    total = aggregated['total_customers']
+    aggregated['mean_risk_score'] = (
+        sum(result['mean_risk_score'] * result['total_customers'] for result in results) / total
+        if total else 0.0
+    )
+    aggregated['timestamp'] = max(result['timestamp'] for result in results)
+    return aggregated
+
+
+def get_cycle_status(store, cycle_id: int) -> Dict:
+    """Aggregate the plan, shard states and results of a cycle across replicas."""
+    lease = store.get(cycle_lease_name(cycle_id))
+    plan = lease['payload'] if lease else {}
+
+    shards = []
+    results = []
+    for record in store.list(f'cycle:{cycle_id}:shard:'):
+        payload = record['payload']
+        shards.append({
+            "shard_index": int(record['name'].rsplit(':', 1)[1]),
+            "replica_id": record['holder_id'],
+            "state": payload.get('state'),
+            "error": payload.get('error')
+        })
+        if payload.get('state') == 'completed' and payload.get('result'):
+            results.append(payload['result'])
+
+    shards.sort(key=lambda shard: shard['shard_index'])
+
+    return {
+        "cycle_id": cycle_id,
+        "leader": plan.get('leader'),
+        "shard_count": plan.get('shard_count'),
+        "live_replicas": live_replicas(store),
+        "completed_shards": sum(1 for shard in shards if shard['state'] == 'completed'),
+        "shards": shards,
+        "result": aggregate_results(results)
+    }
+
+
+def latest_cycle_status(store, interval: float) -> Optional[Dict]:
+    """Return the status of the current cycle, or the previous one if it has not started."""
+    cycle_id = current_cycle_id(interval)
+    for candidate in (cycle_id, cycle_id - 1):
+        if store.get(cycle_lease_name(candidate)):
+            return get_cycle_status(store, candidate)
+    return None
@@ -6,13 +6,19 @@ Loads the trained model and makes predictions on customer data from Supabase.
 import pandas as pd
 import pickle
 import os
+import math
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from supabase import create_client, Client
 import warnings
 from config import (
     SUPABASE_URL, SUPABASE_KEY, MODEL_PATH,
+    SHADOW_MODEL_PATHS, SHADOW_LOG_PATH, SHADOW_MAX_WORKERS, SCHEDULER_CYCLE_BUDGET,
     CHAMPION_THRESHOLD, AT_RISK_THRESHOLD,
     CORE_COLUMNS, DATE_COLUMNS, MODEL_FEATURES
 )
+from scheduler import select_due_customers
 
 warnings.filterwarnings('ignore')
 
@@ -36,6 +42,26 @@ def load_model(model_path=None):
     return model
 
 
+def load_shadow_models(model_paths=None):
+    """Load challenger models to score in shadow alongside the champion."""
+    if model_paths is None:
+        model_paths = SHADOW_MODEL_PATHS
+    
+    shadow_models = {}
+    for path in model_paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in shadow_models:
+            name = path
+        
+        # A broken challenger must never block the champion run
+        try:
+            shadow_models[name] = load_model(path)
+        except Exception as e:
+            print(f"Skipping shadow model {path}: {str(e)}")
+    
+    return shadow_models
+
+
 def fetch_customers_from_supabase():
     """Fetch all customer data from Supabase."""
     print("\nFetching customer data from Supabase...")
@@ -45,6 +71,15 @@ def fetch_customers_from_supabase():
     return df
 
 
+def filter_shard(df, shard_index, shard_count):
+    """Keep only customers whose customer_id hashes to the given shard."""
+    # crc32 is stable across processes, unlike the built-in hash()
+    shard_ids = df['customer_id'].astype(str).map(
+        lambda customer_id: zlib.crc32(customer_id.encode('utf-8')) % shard_count
+    )
+    return df[shard_ids == shard_index].copy()
+
+
 def clean_data(raw_df):
     """Clean and prepare the raw dataset for feature engineering."""
     df = raw_df.copy()
@@ -146,10 +181,10 @@ def feature_engineering(raw_df, reference_date=None):
 
 def prepare_features(df):
     """Prepare feature matrix for prediction."""
-    # Filter to only include columns that exist
-    feature_cols = [col for col in MODEL_FEATURES if col in df.columns]
+    # Align to the model's features; plan dummies absent from this batch are 0
+    feature_cols = list(MODEL_FEATURES)
     
-    X = df[feature_cols].copy()
+    X = df.reindex(columns=feature_cols, fill_value=0)
     X = X.fillna(X.median())
     
     return X, feature_cols
@@ -165,18 +200,146 @@ def classify_status(risk_score):
         return "Critical"
 
 
-def make_predictions(model, df):
-    """Make predictions using the trained model."""
+def score_model(model, X):
+    """Return binary predictions and churn probabilities for one model."""
+    binary_predictions = model.predict(X)
+    probability_scores = model.predict_proba(X)[:, 1]  # Probability of class 1 (churn)
+    return binary_predictions, probability_scores
+
+
+def score_with_shadows(model, shadow_models, X):
+    """
+    Score the champion and any shadow models on the same feature matrix.
+    Models run in parallel threads; a failing shadow model is logged and dropped,
+    while a failing champion raises.
+    """
+    if not shadow_models:
+        return score_model(model, X), {}
+    
+    max_workers = max(1, min(SHADOW_MAX_WORKERS, len(shadow_models) + 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        champion_future = executor.submit(score_model, model, X)
+        shadow_futures = {
+            name: executor.submit(score_model, shadow_model, X)
+            for name, shadow_model in shadow_models.items()
+        }
+        
+        shadow_scores = {}
+        for name, future in shadow_futures.items():
+            try:
+                shadow_scores[name] = future.result()
+            except Exception as e:
+                print(f"Shadow model {name} failed to score: {str(e)}")
+        
+        champion_scores = champion_future.result()
+    
+    return champion_scores, shadow_scores
+
+
+def compare_shadow_scores(customer_ids, champion_scores, shadow_scores, log_path=None,
+                          source='pipeline'):
+    """
+    Log shadow model scores and their agreement with the champion.
+    source tags each logged row ('pipeline' or 'batch') so ad-hoc uploads can
+    be excluded from the offline comparison.
+    """
+    if log_path is None:
+        log_path = SHADOW_LOG_PATH
+    
+    champion_binary, champion_proba = champion_scores
+    champion_binary = champion_binary.astype(bool)
+    champion_status = pd.Series([classify_status(score) for score in champion_proba])
+    customer_ids = pd.Series(customer_ids).reset_index(drop=True)
+    
+    if len(champion_proba) == 0:
+        return {}
+    
+    scored_at = datetime.now().isoformat()
+    comparison = {}
+    log_frames = []
+    
+    print(f"\nShadow Model Comparison (vs champion):")
+    
+    for name, (binary_predictions, probability_scores) in shadow_scores.items():
+        binary_predictions = binary_predictions.astype(bool)
+        status = pd.Series([classify_status(score) for score in probability_scores])
+        
+        stats = {
+            "mean_risk_score": float(probability_scores.mean()),
+            "predicted_churn": int(binary_predictions.sum()),
+            "prediction_agreement": float((binary_predictions == champion_binary).mean()),
+            "status_agreement": float((status == champion_status).mean()),
+            "mean_abs_score_diff": float(abs(probability_scores - champion_proba).mean())
+        }
+        comparison[name] = stats
+        
+        print(f"  {name}:")
+        print(f"    Mean risk score: {stats['mean_risk_score']:.3f} (champion {champion_proba.mean():.3f})")
+        print(f"    Predicted churn: {stats['predicted_churn']} (champion {int(champion_binary.sum())})")
+        print(f"    Prediction agreement: {stats['prediction_agreement']:.1%}")
+        print(f"    Status agreement: {stats['status_agreement']:.1%}")
+        print(f"    Mean abs score diff: {stats['mean_abs_score_diff']:.3f}")
+        
+        log_frames.append(pd.DataFrame({
+            'scored_at': scored_at,
+            'source': source,
+            'model': name,
+            'customer_id': customer_ids,
+            'churn_risk_score': probability_scores,
+            'champion_risk_score': champion_proba,
+            'prediction': binary_predictions,
+            'status_classification': status
+        }))
+    
+    # Append per-customer shadow scores for offline review
+    if log_path and log_frames:
+        try:
+            shadow_log = pd.concat(log_frames, ignore_index=True)
+            shadow_log.to_csv(
+                log_path,
+                mode='a',
+                index=False,
+                header=not os.path.exists(log_path)
+            )
+            print(f"Shadow scores appended to {log_path}")
+        except Exception as e:
+            print(f"Failed to write shadow scores: {str(e)}")
+    
+    return comparison
+
+
+def empty_results():
+    """Return an empty results frame for runs with no customers to score."""
+    return pd.DataFrame({
+        'customer_id': pd.Series(dtype=object),
+        'prediction': pd.Series(dtype=bool),
+        'churn_risk_score': pd.Series(dtype=float),
+        'status_classification': pd.Series(dtype=object)
+    })
+
+
+def make_predictions(model, df, shadow_models=None, customer_ids=None):
+    """
+    Make predictions using the trained model.
+    Shadow models, if given, are scored on the same feature matrix; only the
+    champion's results are returned, with their comparison stored in
+    results.attrs['shadow_comparison']. With customer_ids only those customers
+    are scored, while imputation still uses the whole frame.
+    """
     print("\nMaking predictions...")
     
-    # Prepare features
+    # Prepare features once for every model
     X, feature_cols = prepare_features(df)
     
-    # Make binary predictions
-    binary_predictions = model.predict(X)
+    # Restrict scoring to the requested customers
+    if customer_ids is not None:
+        mask = df['customer_id'].isin(customer_ids)
+        df = df[mask]
+        X = X[mask]
     
-    # Get probability scores (probability of churn class)
-    probability_scores = model.predict_proba(X)[:, 1]  # Probability of class 1 (churn)
+    # Score the champion (and any shadow models) on the shared matrix
+    champion_scores, shadow_scores = score_with_shadows(model, shadow_models, X)
+    binary_predictions, probability_scores = champion_scores
     
     # Create results dataframe
     results = pd.DataFrame({
@@ -199,11 +362,20 @@ def make_predictions(model, df):
     print(f"\nStatus Classification:")
     print(results['status_classification'].value_counts())
     
+    if shadow_scores:
+        results.attrs['shadow_comparison'] = compare_shadow_scores(
+            df['customer_id'], champion_scores, shadow_scores
+        )
+    
     return results
 
 
-def update_supabase(results):
-    """Update Supabase with predictions."""
+def update_supabase(results, write_scored_at=True):
+    """
+    Update Supabase with predictions.
+    last_scored_at is only written when write_scored_at is set, so databases
+    without that column keep working.
+    """
     print("\n" + "=" * 70)
     print("UPDATING SUPABASE DATABASE")
     print("=" * 70)
@@ -211,6 +383,7 @@ def update_supabase(results):
     
     updated_count = 0
     error_count = 0
+    scored_at = datetime.now(timezone.utc).isoformat()
     
     for idx, row in results.iterrows():
         try:
@@ -230,11 +403,15 @@ def update_supabase(results):
                 indicator = "[CRIT]"
             
             # Update database
-            response = supabase.table('data').update({
+            update = {
                 'prediction': row['prediction'],
                 'churn_risk_score': risk_score,
                 'status_classification': status
-            }).eq('customer_id', customer_id).execute()
+            }
+            if write_scored_at:
+                update['last_scored_at'] = scored_at
+            
+            response = supabase.table('data').update(update).eq('customer_id', customer_id).execute()
             
             updated_count += 1
             
@@ -255,8 +432,16 @@ def update_supabase(results):
     return updated_count, error_count
 
 
-def run_prediction_pipeline(model_path=None):
-    """Run the complete prediction pipeline."""
+def run_prediction_pipeline(model_path=None, shadow_model_paths=None,
+                            shard_index=None, shard_count=None, scheduled=False):
+    """
+    Run the complete prediction pipeline.
+    Shadow models default to SHADOW_MODEL_PATHS; only the champion's results
+    are written to Supabase. With shard_count > 1 only the customers hashed
+    to shard_index are scored and updated. With scheduled=True only the
+    accounts the adaptive scheduler selects are rescored, and its summary is
+    stored in results.attrs['schedule'].
+    """
     if model_path is None:
         model_path = MODEL_PATH
     
@@ -267,20 +452,61 @@ def run_prediction_pipeline(model_path=None):
     # Load model
     model = load_model(model_path)
     
+    # Load shadow (challenger) models
+    shadow_models = load_shadow_models(shadow_model_paths)
+    if shadow_models:
+        print(f"Shadow models: {', '.join(shadow_models)}")
+    
     # Fetch data from Supabase
     raw_df = fetch_customers_from_supabase()
     
+    if raw_df.empty:
+        print("No customers to score")
+        return empty_results()
+    
+    # Scheduling needs score ages; fail fast instead of treating every account as unscored
+    has_scored_at = 'last_scored_at' in raw_df.columns
+    if scheduled and not has_scored_at:
+        raise ValueError(
+            "data.last_scored_at column is missing; run update_schema.sql to enable scheduled predictions"
+        )
+    
     # Clean data
     cleaned_df = clean_data(raw_df)
     
     # Engineer features
     featured_df = feature_engineering(cleaned_df)
     
+    # Restrict scoring to this replica's shard; features use the whole portfolio
+    candidates_df = raw_df
+    customer_ids = None
+    if shard_count and shard_count > 1:
+        candidates_df = filter_shard(raw_df, shard_index, shard_count)
+        customer_ids = candidates_df['customer_id']
+        print(f"Scoring shard {shard_index + 1}/{shard_count}: {len(candidates_df)} customers")
+    
+    # Keep only accounts due for rescoring, splitting the budget across shards
+    schedule = None
+    if scheduled:
+        budget = math.ceil(SCHEDULER_CYCLE_BUDGET / (shard_count or 1))
+        selected_df, schedule = select_due_customers(candidates_df, budget)
+        customer_ids = selected_df['customer_id']
+    
+    if customer_ids is not None and len(customer_ids) == 0:
+        print("No customers to score")
+        results = empty_results()
+        if schedule is not None:
+            results.attrs['schedule'] = schedule
+        return results
+    
     # Make predictions
-    results = make_predictions(model, featured_df)
+    results = make_predictions(model, featured_df, shadow_models, customer_ids)
     
     # Update Supabase
-    update_supabase(results)
+    update_supabase(results, write_scored_at=has_scored_at)
+    
+    if schedule is not None:
+        results.attrs['schedule'] = schedule
     
     print("\n" + "=" * 60)
     print("PIPELINE COMPLETE")
@@ -0,0 +1,133 @@
+"""
+Risk-tiered adaptive scoring scheduler.
+Decides which accounts are due for rescoring each cycle based on their last
+risk tier and score age, and reports per-tier score staleness.
+"""
+
+import math
+import pandas as pd
+from typing import Dict, Optional, Tuple
+from config import (
+    CHAMPION_THRESHOLD, AT_RISK_THRESHOLD, BOUNDARY_MARGIN,
+    TIER_REFRESH_INTERVALS, AUTO_PREDICTION_INTERVAL,
+    SCHEDULER_HEADROOM, SCHEDULER_MIN_REFRESH_RATIO
+)
+
+
+def assign_tiers(df: pd.DataFrame) -> pd.Series:
+    """
+    Assign each account a refresh tier from its last classification.
+    Accounts whose score sits within BOUNDARY_MARGIN of a classification
+    threshold move to the Boundary tier when that refreshes them sooner.
+    """
+    scores = pd.to_numeric(
+        df.get('churn_risk_score', pd.Series(index=df.index, dtype=float)),
+        errors='coerce'
+    )
+    status = df.get('status_classification', pd.Series(index=df.index, dtype=object))
+
+    tiers = status.where(status.isin(['Champion', 'At-Risk', 'Critical']), 'Unscored')
+    tiers = tiers.where(scores.notna(), 'Unscored')
+
+    near_boundary = (
+        ((scores - CHAMPION_THRESHOLD).abs() <= BOUNDARY_MARGIN) |
+        ((scores - AT_RISK_THRESHOLD).abs() <= BOUNDARY_MARGIN)
+    )
+    slower_than_boundary = tiers.map(TIER_REFRESH_INTERVALS) > TIER_REFRESH_INTERVALS['Boundary']
+    tiers = tiers.where(~(near_boundary & slower_than_boundary), 'Boundary')
+
+    return tiers
+
+
+def score_ages(df: pd.DataFrame, now: Optional[pd.Timestamp] = None) -> pd.Series:
+    """Return seconds since each account was last scored (NaN if never)."""
+    if now is None:
+        now = pd.Timestamp.now(tz='UTC')
+
+    last_scored = pd.to_datetime(
+        df.get('last_scored_at', pd.Series(index=df.index, dtype=object)),
+        errors='coerce',
+        utc=True,
+        format='ISO8601'  # Postgres omits zero fractional seconds
+    )
+    return (now - last_scored).dt.total_seconds()
+
+
+def refresh_priority(tiers: pd.Series, ages: pd.Series) -> pd.Series:
+    """
+    Priority is score age as a fraction of the tier's refresh interval.
+    Values >= 1 are due; never-scored or Unscored accounts are infinitely overdue.
+    """
+    intervals = tiers.map(TIER_REFRESH_INTERVALS).astype(float)
+    priority = ages / intervals.where(intervals > 0)
+    return priority.where(ages.notna() & (intervals > 0), math.inf)
+
+
+def tier_staleness(df: pd.DataFrame, now: Optional[pd.Timestamp] = None) -> Dict:
+    """Summarize score staleness per refresh tier."""
+    tiers = assign_tiers(df)
+    ages = score_ages(df, now)
+    priority = refresh_priority(tiers, ages)
+
+    metrics = {}
+    for tier, interval in TIER_REFRESH_INTERVALS.items():
+        in_tier = tiers == tier
+        tier_ages = ages[in_tier].dropna()
+
+        metrics[tier] = {
+            "accounts": int(in_tier.sum()),
+            "due": int((priority[in_tier] >= 1).sum()),
+            "never_scored": int(ages[in_tier].isna().sum()),
+            "refresh_interval_seconds": interval,
+            "mean_staleness_seconds": float(tier_ages.mean()) if len(tier_ages) else None,
+            "max_staleness_seconds": float(tier_ages.max()) if len(tier_ages) else None
+        }
+
+    return metrics
+
+
+def select_due_customers(df: pd.DataFrame, budget: int,
+                         now: Optional[pd.Timestamp] = None) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Pick the accounts to rescore this cycle, most overdue first.
+    The cycle takes the steady-state share of the portfolio (plus headroom)
+    capped at budget, so rescoring is spread evenly across cycles rather than
+    arriving as one sweep. Accounts not yet due may fill spare capacity once
+    SCHEDULER_MIN_REFRESH_RATIO of their interval has passed, which gradually
+    staggers accounts that were all scored at the same time.
+    """
+    tiers = assign_tiers(df)
+    ages = score_ages(df, now)
+    priority = refresh_priority(tiers, ages)
+
+    # Expected rescores per cycle if every tier is refreshed on schedule
+    intervals = tiers.map(TIER_REFRESH_INTERVALS).astype(float)
+    steady_rate = (AUTO_PREDICTION_INTERVAL / intervals.where(intervals > 0)).fillna(1).sum()
+    pace = math.ceil(steady_rate * SCHEDULER_HEADROOM)
+    limit = min(budget, pace)
+
+    eligible = priority[priority >= SCHEDULER_MIN_REFRESH_RATIO]
+    selected_index = eligible.sort_values(ascending=False, kind='stable').head(limit).index
+
+    metrics = tier_staleness(df, now)
+    selected_tiers = tiers.loc[selected_index].value_counts()
+    for tier in metrics:
+        metrics[tier]["selected"] = int(selected_tiers.get(tier, 0))
+
+    schedule = {
+        "accounts": len(df),
+        "due": int((priority >= 1).sum()),
+        "selected": len(selected_index),
+        "budget": budget,
+        "pace": pace,
+        "tiers": metrics
+    }
+
+    print(f"\nAdaptive schedule: {schedule['selected']} of {schedule['accounts']} accounts selected "
+          f"({schedule['due']} due, pace {pace}, budget {budget})")
+    for tier, tier_metrics in metrics.items():
+        if tier_metrics["accounts"]:
+            print(f"  {tier:<9} accounts: {tier_metrics['accounts']:5d} | due: {tier_metrics['due']:5d} | "
+                  f"selected: {tier_metrics['selected']:5d}")
+
+    return df.loc[selected_index].copy(), schedule
@@ -8,6 +8,10 @@ ADD COLUMN IF NOT EXISTS prediction boolean NULL;
 ALTER TABLE public.data 
 ADD COLUMN IF NOT EXISTS status_classification text NULL;
 
+-- Add last_scored_at column used by the adaptive scheduler
+ALTER TABLE public.data 
+ADD COLUMN IF NOT EXISTS last_scored_at timestamptz NULL;
+
 -- Add index on status_classification for faster filtering
 CREATE INDEX IF NOT EXISTS idx_status_classification 
 ON public.data(status_classification);
@@ -29,3 +33,21 @@ COMMENT ON COLUMN public.data.churn_risk_score IS
 
 COMMENT ON COLUMN public.data.status_classification IS 
 'Customer status based on churn risk score: Champion (<50%), At-Risk (50-75%), Critical (>=75%)';
+
+COMMENT ON COLUMN public.data.last_scored_at IS 
+'When the churn risk score was last written; drives per-tier rescoring cadence';
+
+-- Lease table used to coordinate scheduled predictions across API replicas
+-- (only needed with COORDINATION_BACKEND=supabase)
+CREATE TABLE IF NOT EXISTS public.prediction_leases (
+    name text PRIMARY KEY,
+    holder_id text NOT NULL,
+    expires_at double precision NOT NULL,
+    payload jsonb NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_prediction_leases_expires_at
+ON public.prediction_leases(expires_at);
+
+COMMENT ON TABLE public.prediction_leases IS
+'Replica heartbeats, cycle leadership and shard claims for scheduled predictions';